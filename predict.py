@@ -1,17 +1,151 @@
 import os
+import queue
 import subprocess
+import sys
+import tempfile
 import shutil
 import re
+import threading
+import time
+import uuid
+from contextlib import nullcontext
 from pathlib import Path
 from typing import Optional
+from zipfile import ZipFile, ZIP_DEFLATED, ZIP_STORED
 from cog import BasePredictor, Input, Path as CogPath
 from rich.console import Console
 from rich.progress import Progress, SpinnerColumn, TextColumn, BarColumn, TaskProgressColumn
 from rich.panel import Panel
 from rich.text import Text
+from rich.markup import escape
 
 console = Console()
 
+# HTTrack output pattern, matched against lowercased raw bytes from the
+# subprocess pipe; the named group that matched tells us whether it is
+# progress, bytes or a file
+_OUTPUT_RE = re.compile(
+    rb'(?P<pct>\d+)%'
+    rb'|(?P<bytes>\d+)\s*bytes?\s+transferred'
+    rb'|(?P<file>file generated|saved|written)'
+)
+
+# Already-compressed formats gain almost nothing from deflate, so store them as-is
+_STORED_SUFFIXES = frozenset({
+    ".png", ".jpg", ".jpeg", ".gif", ".webp", ".mp4", ".mov", ".avi",
+    ".mp3", ".wav", ".ico", ".woff", ".woff2", ".zip", ".gz",
+})
+
+# HTTrack options passed on every run
+_BASE_FLAGS = (
+    "-v",  # Verbose mode
+    "--display",
+    "--quiet",  # Less verbose
+    "-%k",  # Keep-alive, reuse connections between requests
+    "-%c5",  # New connections per second, HTTrack's security limit
+    "-%v",  # No verbose mode (cleaner output)
+    "-I0",  # No top-level index.html, the archive is the deliverable
+    "-C0",  # No hts-cache copy of every file, runs are never updated
+)
+
+# HTTrack filters that exclude media files when include_media is off
+_NO_MEDIA_FLAGS = (
+    "-*gif", "-*jpg", "-*jpeg", "-*png", "-*svg", "-*webp",
+    "-*mp4", "-*avi", "-*mov", "-*mp3", "-*wav", "-*ico",
+)
+
+# Renderables and templates that do not change between requests
+_BANNER = Panel.fit(
+    "[bold cyan]🕷️  HTTrack Website Scraper[/bold cyan]\n"
+    "[dim]Powered by Replicate Cog[/dim]",
+    border_style="cyan"
+)
+
+_CONFIG_TEMPLATE = (
+    "[bold yellow]📋 Configuration:[/bold yellow]\n"
+    "[white]"
+    "  • URL: {url}\n"
+    "  • Max Depth: {max_depth}\n"
+    "  • Max Size: {max_size} MB\n"
+    "  • External Links: {external_links}\n"
+    "  • Include Media: {include_media}\n"
+    "  • Connections: {connections}\n"
+    "[/white]"
+)
+
+_SUMMARY_TEMPLATE = (
+    "[bold green]✨ Scraping Complete![/bold green]\n\n"
+    "[white]"
+    "  📊 Files Scraped: {file_count}\n"
+    "  💾 Total Size: {total_size_mb:.2f} MB\n"
+    "  📦 Archive Size: {zip_size_mb:.2f} MB\n"
+    "  📁 Output: {output}\n"
+    "[/white]"
+)
+
+_SCRAPE_COLUMNS = (
+    SpinnerColumn(),
+    TextColumn("[progress.description]{task.description}"),
+    BarColumn(),
+    TaskProgressColumn(),
+)
+
+_ZIP_COLUMNS = (
+    SpinnerColumn(),
+    TextColumn("[progress.description]{task.description}"),
+)
+
+# Process umask, read once at import while no other threads are running;
+# os.umask() can only be queried by setting it
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+# Minimum seconds between progress description redraws
+_PROGRESS_INTERVAL = 0.1
+
+def _walk_tree(path):
+    """Yield a DirEntry for every directory and regular file under path.
+
+    Directories come before their contents; symlinks are not followed.
+    """
+    with os.scandir(path) as it:
+        for entry in it:
+            if entry.is_dir(follow_symlinks=False):
+                yield entry
+                yield from _walk_tree(entry.path)
+            elif entry.is_file(follow_symlinks=False):
+                yield entry
+
+def _pump_lines(stream, lines):
+    """Copy every line from stream into the lines queue, then a None sentinel.
+
+    Lines are split on \r as well as \n, like text-mode universal newlines, so
+    HTTrack's carriage-return status redraws arrive as separate records. The
+    sentinel is queued even if reading fails, so the consumer never waits forever.
+    """
+    try:
+        for chunk in stream:
+            for line in chunk.replace(b'\r\n', b'\n').replace(b'\r', b'\n').split(b'\n'):
+                if line:
+                    lines.put(line)
+    finally:
+        lines.put(None)
+
+def _progress_enabled():
+    """Show live progress only for interactive runs; PROGRESS=0/1 overrides detection."""
+    setting = os.environ.get("PROGRESS")
+    if setting is not None:
+        return setting != "0"
+    return sys.stdout.isatty()
+
+def _remove_in_background(path):
+    """Move path out of the way immediately and delete it on a daemon thread."""
+    doomed = path.with_name(f"{path.name}.old.{uuid.uuid4().hex}")
+    os.rename(path, doomed)
+    threading.Thread(
+        target=shutil.rmtree, args=(doomed,), kwargs={"ignore_errors": True}, daemon=True
+    ).start()
+
 class Predictor(BasePredictor):
     def predict(
         self,
@@ -38,17 +172,19 @@ class Predictor(BasePredictor):
             description="Download images, videos, and other media files",
             default=True,
         ),
+        connections: int = Input(
+            description="Number of simultaneous connections to the site (HTTrack caps this at 8)",
+            default=8,
+            ge=1,
+            le=8,
+        ),
     ) -> CogPath:
         """
         Scrape a website using HTTrack and return a ZIP archive of the results.
         """
         
         # Display startup banner
-        console.print(Panel.fit(
-            "[bold cyan]🕷️  HTTrack Website Scraper[/bold cyan]\n"
-            "[dim]Powered by Replicate Cog[/dim]",
-            border_style="cyan"
-        ))
+        console.print(_BANNER)
         
         # Validate URL
         if not url.startswith(('http://', 'https://')):
@@ -57,123 +193,146 @@ class Predictor(BasePredictor):
         # Create output directory
         output_dir = Path("/tmp/httrack_output")
         if output_dir.exists():
-            shutil.rmtree(output_dir)
+            _remove_in_background(output_dir)
         output_dir.mkdir(exist_ok=True)
         
         # Create project directory - HTTrack will create subdirectories
         project_name = "website_scrape"
         
-        # Build HTTrack command
+        # Build HTTrack command; only the per-request options are formatted here
         cmd = [
             "httrack",
             url,
             "-O", str(output_dir / project_name),
-            "-v",  # Verbose mode
-            "--display",
+            *_BASE_FLAGS,
+            f"-c{connections}",  # Max simultaneous connections
+            f"-r{max_depth or 9}",  # Depth limit, 9 is HTTrack's max
         ]
         
-        # Add depth limit
-        if max_depth > 0:
-            cmd.extend([f"-r{max_depth}"])
-        else:
-            cmd.extend(["-r9"])  # HTTrack max depth
-        
         # Add size limit
         if max_size > 0:
-            cmd.extend([f"-M{max_size * 1048576}"])  # Convert MB to bytes
+            cmd.append(f"-M{max_size * 1048576}")  # Convert MB to bytes
         
         # External links
         if not external_links:
-            cmd.extend(["-%e0"])  # Don't follow external links
+            cmd.append("-%e0")  # Don't follow external links
         
         # Media handling
         if not include_media:
-            cmd.extend([
-                "-*gif", "-*jpg", "-*jpeg", "-*png", "-*svg", "-*webp",
-                "-*mp4", "-*avi", "-*mov", "-*mp3", "-*wav", "-*ico"
-            ])
-        
-        # Additional options for better results
-        cmd.extend([
-            "--quiet",  # Less verbose
-            "-c8",  # Max simultaneous connections
-            "-%v",  # No verbose mode (cleaner output)
-        ])
+            cmd += _NO_MEDIA_FLAGS
         
         # Display configuration
-        config_text = Text()
-        config_text.append("📋 Configuration:\n", style="bold yellow")
-        config_text.append(f"  • URL: {url}\n", style="white")
-        config_text.append(f"  • Max Depth: {max_depth if max_depth > 0 else 'Unlimited'}\n", style="white")
-        config_text.append(f"  • Max Size: {max_size if max_size > 0 else 'Unlimited'} MB\n", style="white")
-        config_text.append(f"  • External Links: {'Yes' if external_links else 'No'}\n", style="white")
-        config_text.append(f"  • Include Media: {'Yes' if include_media else 'No'}\n", style="white")
+        config_text = Text.from_markup(_CONFIG_TEMPLATE.format(
+            url=escape(url),
+            max_depth=max_depth if max_depth > 0 else 'Unlimited',
+            max_size=max_size if max_size > 0 else 'Unlimited',
+            external_links='Yes' if external_links else 'No',
+            include_media='Yes' if include_media else 'No',
+            connections=connections,
+        ))
         console.print(Panel(config_text, border_style="yellow"))
         
-        # Run HTTrack with progress monitoring
+        # Run HTTrack, with progress monitoring when attached to a terminal
         console.print("\n[bold green]🚀 Starting website scrape...[/bold green]\n")
+        show_progress = _progress_enabled()
+        files_downloaded = 0
+        bytes_downloaded = 0
         
         try:
-            with Progress(
-                SpinnerColumn(),
-                TextColumn("[progress.description]{task.description}"),
-                BarColumn(),
-                TaskProgressColumn(),
-                console=console,
-            ) as progress:
-                
-                scrape_task = progress.add_task("[cyan]Scraping website...", total=100)
-                
-                process = subprocess.Popen(
+            if not show_progress:
+                # Nobody is watching: discard HTTrack output instead of parsing it
+                process = subprocess.run(
                     cmd,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.STDOUT,
-                    universal_newlines=True,
-                    bufsize=1
+                    stdout=subprocess.DEVNULL,
+                    stderr=subprocess.DEVNULL,
                 )
                 
-                files_downloaded = 0
-                bytes_downloaded = 0
-                last_progress = 0
-                
-                for line in process.stdout:
-                    line = line.strip()
+                if process.returncode != 0:
+                    console.print(f"[yellow]⚠ HTTrack exited with code {process.returncode}[/yellow]")
+            else:
+                with Progress(*_SCRAPE_COLUMNS, console=console) as progress:
                     
-                    if not line:
-                        continue
+                    scrape_task = progress.add_task("[cyan]Scraping website...", total=100)
                     
-                    # Parse HTTrack progress percentage
-                    percent_match = re.search(r'(\d+)%', line)
-                    if percent_match:
-                        percent = int(percent_match.group(1))
-                        if percent > last_progress:
-                            last_progress = percent
-                            progress.update(scrape_task, completed=percent)
+                    process = subprocess.Popen(
+                        cmd,
+                        stdout=subprocess.PIPE,
+                        stderr=subprocess.STDOUT,
+                        bufsize=1 << 16,  # Large binary buffer, fewer read() calls
+                    )
                     
-                    # Count files
-                    if re.search(r'File generated|saved|written', line, re.IGNORECASE):
-                        files_downloaded += 1
-                        progress.update(
-                            scrape_task,
-                            description=f"[cyan]Downloaded {files_downloaded} files..."
-                        )
+                    last_progress = 0
+                    last_update = time.monotonic()
+                    pending_description = None
                     
-                    # Parse bytes transferred
-                    bytes_match = re.search(r'(\d+)\s*bytes?\s+transferred', line, re.IGNORECASE)
-                    if bytes_match:
-                        bytes_downloaded = int(bytes_match.group(1))
-                        mb_downloaded = bytes_downloaded / (1024 * 1024)
-                        progress.update(
-                            scrape_task,
-                            description=f"[cyan]Downloading... ({mb_downloaded:.1f} MB)"
-                        )
-                
-                process.wait()
-                
-                if process.returncode != 0:
-                    console.print(f"[yellow]⚠ HTTrack exited with code {process.returncode}[/yellow]")
-                
-                progress.update(scrape_task, completed=100, description="[green]✓ Scraping complete!")
+                    # A reader thread drains the pipe so HTTrack never blocks on a
+                    # full buffer while we are busy redrawing
+                    lines = queue.Queue()
+                    reader = threading.Thread(
+                        target=_pump_lines, args=(process.stdout, lines), daemon=True
+                    )
+                    reader.start()
+                    
+                    while True:
+                        try:
+                            line = lines.get(timeout=_PROGRESS_INTERVAL)
+                        except queue.Empty:
+                            line = b''  # Idle tick, still flush any pending redraw
+                        
+                        if line is None:
+                            break
+                        
+                        line = line.strip()
+                        
+                        # Cheap substring checks gate the regex; most lines match nothing
+                        low = line.lower()
+                        percent_changed = False
+                        if (
+                            b'%' in line or b'yte' in low or b'saved' in low
+                            or b'written' in low or b'file generated' in low
+                        ):
+                            file_counted = False
+                            for match in _OUTPUT_RE.finditer(low):
+                                kind = match.lastgroup
+                                
+                                if kind == 'pct':
+                                    # Parse HTTrack progress percentage, keeping the highest
+                                    percent = int(match.group('pct'))
+                                    if percent > last_progress:
+                                        last_progress = percent
+                                        percent_changed = True
+                                elif kind == 'file':
+                                    # Count files, at most once per line
+                                    if not file_counted:
+                                        file_counted = True
+                                        files_downloaded += 1
+                                        pending_description = f"[cyan]Downloaded {files_downloaded} files..."
+                                else:
+                                    # Parse bytes transferred; the latest total wins
+                                    bytes_downloaded = int(match.group('bytes'))
+                                    mb_downloaded = bytes_downloaded / (1024 * 1024)
+                                    pending_description = f"[cyan]Downloading... ({mb_downloaded:.1f} MB)"
+                        
+                        # Coalesce redraws; counters above are always kept current
+                        now = time.monotonic()
+                        if percent_changed or (
+                            pending_description and now - last_update > _PROGRESS_INTERVAL
+                        ):
+                            progress.update(
+                                scrape_task,
+                                completed=last_progress,
+                                description=pending_description,
+                            )
+                            pending_description = None
+                            last_update = now
+                    
+                    process.wait()
+                    reader.join()
+                    
+                    if process.returncode != 0:
+                        console.print(f"[yellow]⚠ HTTrack exited with code {process.returncode}[/yellow]")
+                    
+                    progress.update(scrape_task, completed=100, description="[green]✓ Scraping complete!")
             
             # Find the actual scraped content
             project_dir = output_dir / project_name
@@ -181,43 +340,98 @@ class Predictor(BasePredictor):
             if not project_dir.exists():
                 raise RuntimeError(f"HTTrack did not create expected directory: {project_dir}")
             
-            # Count files in the scraped directory
-            all_files = list(project_dir.rglob("*"))
-            file_count = sum(1 for f in all_files if f.is_file())
-            
-            # Calculate total size
-            total_size = sum(f.stat().st_size for f in all_files if f.is_file())
-            total_size_mb = total_size / (1024 * 1024)
-            
-            console.print(f"\n[bold green]✓ Successfully scraped {file_count} files ({total_size_mb:.2f} MB)[/bold green]")
-            
-            # Debug: Show directory structure
-            console.print(f"[dim]Output directory: {project_dir}[/dim]")
-            subdirs = [d.name for d in project_dir.iterdir() if d.is_dir()]
-            if subdirs:
-                console.print(f"[dim]Subdirectories: {', '.join(subdirs[:5])}{'...' if len(subdirs) > 5 else ''}[/dim]")
-            
             # Create ZIP archive
             console.print("\n[bold yellow]📦 Creating ZIP archive...[/bold yellow]")
             
             zip_path = output_dir / "scraped_website.zip"
+            root_prefix = str(project_dir) + os.sep
+            file_count = 0
+            total_size = 0
             
-            with Progress(
-                SpinnerColumn(),
-                TextColumn("[progress.description]{task.description}"),
-                console=console,
-            ) as progress:
+            with Progress(*_ZIP_COLUMNS, console=console) as progress:
                 zip_task = progress.add_task("[yellow]Compressing files...", total=None)
                 
-                # Create archive from the project directory
-                shutil.make_archive(
-                    str(output_dir / "scraped_website"),
-                    'zip',
-                    project_dir
-                )
+                # Prefer Info-ZIP (installed via cog.yaml); it runs outside the
+                # interpreter. The in-process ZipFile writer is the fallback.
+                zip_bin = shutil.which("zip")
+                
+                # Build the archive in a temp file beside the final path and
+                # rename it into place, so a partial ZIP is never published
+                tmp_zip = tempfile.NamedTemporaryFile(dir=output_dir, suffix=".zip", delete=False)
+                try:
+                    with tmp_zip:
+                        if zip_bin:
+                            zip_result = subprocess.run(
+                                [
+                                    zip_bin, "-r", "-q", "-1",
+                                    # Store these as-is; -n is case-sensitive on Linux
+                                    "-n", ":".join(sorted(
+                                        _STORED_SUFFIXES | {s.upper() for s in _STORED_SUFFIXES}
+                                    )),
+                                    "-", ".",  # Archive goes to stdout
+                                ],
+                                cwd=project_dir,
+                                stdout=tmp_zip,
+                                stderr=subprocess.PIPE,
+                            )
+                            if zip_result.returncode == 12:
+                                # "Nothing to do": the tree is empty, let ZipFile
+                                # write an empty archive like make_archive did
+                                zip_bin = None
+                            elif zip_result.returncode != 0:
+                                raise RuntimeError(
+                                    f"zip exited with code {zip_result.returncode}: "
+                                    f"{zip_result.stderr.decode(errors='replace').strip()}"
+                                )
+                        
+                        if zip_bin and files_downloaded and bytes_downloaded:
+                            # HTTrack already reported the totals, skip the tree walk
+                            file_count = files_downloaded
+                            total_size = bytes_downloaded
+                        else:
+                            # Single pass over the tree: count, size and, without
+                            # the zip binary, the archive itself
+                            with nullcontext() if zip_bin else ZipFile(
+                                tmp_zip, 'w', compression=ZIP_DEFLATED, compresslevel=1, allowZip64=True
+                            ) as zf:
+                                for entry in _walk_tree(project_dir):
+                                    arcname = entry.path[len(root_prefix):]
+                                    if entry.is_dir(follow_symlinks=False):
+                                        # Keep directory entries, empty ones included,
+                                        # as zip -r and make_archive do
+                                        if zf is not None:
+                                            zf.mkdir(arcname)
+                                        continue
+                                    file_count += 1
+                                    total_size += entry.stat(follow_symlinks=False).st_size
+                                    if zf is not None:
+                                        suffix = os.path.splitext(entry.name)[1].lower()
+                                        zf.write(
+                                            entry.path,
+                                            arcname,
+                                            compress_type=ZIP_STORED if suffix in _STORED_SUFFIXES else None,
+                                        )
+                    
+                    # NamedTemporaryFile is 0600; publish with the usual umask mode
+                    os.chmod(tmp_zip.name, 0o666 & ~_UMASK)
+                    os.replace(tmp_zip.name, zip_path)
+                except BaseException:
+                    os.unlink(tmp_zip.name)
+                    raise
                 
                 progress.update(zip_task, description="[green]✓ Archive created!")
             
+            total_size_mb = total_size / (1024 * 1024)
+            
+            console.print(f"\n[bold green]✓ Successfully scraped {file_count} files ({total_size_mb:.2f} MB)[/bold green]")
+            
+            # Debug: Show directory structure
+            console.print(f"[dim]Output directory: {project_dir}[/dim]")
+            with os.scandir(project_dir) as it:
+                subdirs = [entry.name for entry in it if entry.is_dir()]
+            if subdirs:
+                console.print(f"[dim]Subdirectories: {', '.join(subdirs[:5])}{'...' if len(subdirs) > 5 else ''}[/dim]")
+            
             # Verify ZIP was created
             if not zip_path.exists():
                 raise RuntimeError(f"ZIP file was not created at {zip_path}")
@@ -226,12 +440,12 @@ class Predictor(BasePredictor):
             zip_size_mb = zip_path.stat().st_size / (1024 * 1024)
             
             # Display success summary
-            summary = Text()
-            summary.append("✨ Scraping Complete!\n\n", style="bold green")
-            summary.append(f"  📊 Files Scraped: {file_count}\n", style="white")
-            summary.append(f"  💾 Total Size: {total_size_mb:.2f} MB\n", style="white")
-            summary.append(f"  📦 Archive Size: {zip_size_mb:.2f} MB\n", style="white")
-            summary.append(f"  📁 Output: {zip_path.name}\n", style="white")
+            summary = Text.from_markup(_SUMMARY_TEMPLATE.format(
+                file_count=file_count,
+                total_size_mb=total_size_mb,
+                zip_size_mb=zip_size_mb,
+                output=escape(zip_path.name),
+            ))
             
             console.print(Panel(summary, border_style="green", title="Summary"))
             
@@ -245,9 +459,15 @@ class Predictor(BasePredictor):
                 console.print(f"\n[yellow]Debug Info:[/yellow]")
                 console.print(f"Output dir exists: {output_dir.exists()}")
                 if output_dir.exists():
-                    contents = list(output_dir.rglob("*"))
-                    console.print(f"Contents found: {len(contents)} items")
-                    for item in contents[:10]:  # Show first 10 items
-                        console.print(f"  - {item.relative_to(output_dir)}")
+                    item_count = 0
+                    first_items = []
+                    for dirpath, dirnames, filenames in os.walk(output_dir):
+                        for name in dirnames + filenames:
+                            item_count += 1
+                            if len(first_items) < 10:  # Show first 10 items
+                                first_items.append(os.path.relpath(os.path.join(dirpath, name), output_dir))
+                    console.print(f"Contents found: {item_count} items")
+                    for item in first_items:
+                        console.print(f"  - {item}")
             
             raise
\ No newline at end of file